@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+
+'''
+Benchmark of Python program runs: cold interpreter starts versus
+pre-warmed interpreters (see pyserver.py).
+
+Runs a program many times with each execution path of PGS, same input,
+and prints the wall time per run. If no program is given, a short test
+case that reads numbers and uses common modules is used.
+
+Example:
+python3 bench_warm.py
+python3 bench_warm.py -n 200 -p python3 prog.py input.txt
+'''
+
+import os
+import sys
+import argparse
+import statistics
+import tempfile
+import pgs
+
+
+# Short test case, startup dominates its run time
+testprog = '''
+import sys, math, collections, itertools
+nums = [int(x) for x in sys.stdin.read().split()]
+print(sum(nums), math.isqrt(sum(nums)), collections.Counter(nums).most_common(1))
+'''
+'''str: Default program for benchmarking'''
+
+testinput = b' '.join(str(i).encode() for i in range(1000))
+'''bytes: Default input for benchmarking'''
+
+
+def benchRuns(runner=None, argv=[], inbuf=b'', nruns=1):
+    '''
+    Run program 'nruns' times, returns list of wall times (seconds)
+    '''
+    times = []
+    for i in range(nruns):
+        res = runner(argv=argv, inbuf=inbuf, capture=True, merge=True)
+        if not res.ok():
+            print("*** Error: program failed ***\n" + res.stdout.decode(errors='replace'))
+            sys.exit(1)
+        times.append(res.elapsed)
+    return times
+
+
+def printTimes(label='', times=[]):
+    '''
+    Print statistics of wall times, milliseconds
+    '''
+    print("{:<6} mean {:8.2f} ms   median {:8.2f} ms   min {:8.2f} ms".format(
+          label, 1000 * statistics.mean(times), 1000 * statistics.median(times),
+          1000 * min(times)))
+
+
+'''
+Main entry point
+'''
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark cold vs pre-warmed Python runs')
+    parser.add_argument('-n', '--runs', type=int, default=50, dest='nruns',
+                        help='number of runs per execution path')
+    parser.add_argument('-p', '--interpreter', type=str, default='python3', dest='compiler',
+                        help='Python interpreter')
+    parser.add_argument('script', nargs='?', default='', help='Python program')
+    parser.add_argument('infile', nargs='?', default='', help='input file for program')
+    args = parser.parse_args()
+
+    pgs.compiler = args.compiler
+    pgs.python = True
+    pgs.pywarm = True
+
+    with tempfile.TemporaryDirectory(prefix="pgs-bench-") as tmpdir:
+        script = os.path.abspath(args.script) if args.script else os.path.join(tmpdir, "prog.py")
+        if not args.script:
+            with open(script, 'w') as fd: fd.write(testprog)
+        inbuf = pgs.loadInput(os.path.abspath(args.infile)) if args.infile else testinput
+        argv = [args.compiler, script]
+
+        # Server startup is not part of the measured runs, first runs warm up caches
+        pgs.startPyServer()
+        benchRuns(pgs.execCommand, argv, inbuf, 3)
+        benchRuns(pgs.execWarm, argv, inbuf, 3)
+
+        cold = benchRuns(pgs.execCommand, argv, inbuf, args.nruns)
+        warm = benchRuns(pgs.execWarm, argv, inbuf, args.nruns)
+
+    print("Runs: " + str(args.nruns) + ", program: " + (args.script or "default test case"))
+    printTimes("cold", cold)
+    printTimes("warm", warm)
+    print("speedup {:.2f}x".format(statistics.mean(cold) / statistics.mean(warm)))
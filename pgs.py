@@ -13,6 +13,7 @@ assignment/labs by providing the following functionalities:
     * Mark/classify directories/files for compilation
     * Compile program
     * Run program
+    * Batch grading (extract, build, autograde) with local/remote workers
 
 A text configuration file is used to specify the list of students
 (with unique identifiers) to consider during grading.
@@ -22,12 +23,16 @@ corresponding lab from the labs directory.
 Example:
 python3 pgs.py --help
 python3 pgs.py -s
+python3 pgs.py -l students.txt -b -j 4 -i tests/*.in -o tests/*.out
+python3 pgs.py -l students.txt -b -j 2 --serve /tmp/pgs.sock
+PGS_AUTHKEY=$(cat keyfile) python3 pgs.py -l students.txt -b -j 0 --serve grader1:5000
+PGS_AUTHKEY=$(cat keyfile) python3 pgs.py --worker grader1:5000
+python3 pgs.py -l students.txt --watch 60 -i tests/*.in -o tests/*.out
 
 Todo:
     * Manual
     * Configuration file
     * Clean code
-    * Change system calls to subprocess
     * Refactor framework to behave like a shell with custom commands,
       commands that are not part of the framework are passed directly
       to the underlying shell. Maybe it is better to make real shell
@@ -48,21 +53,61 @@ import gzip
 import bz2
 import subprocess
 import signal
+import socket
+import threading
+import queue
+import time
+import csv
+import shlex
+import selectors
+import asyncio
+import json
+import tempfile
+import atexit
+import hashlib
+import errno
+import stat
+import fcntl
+import secrets
+import ipaddress
+from multiprocessing.managers import BaseManager
 
 
 # Global build options, supports C++ and Python
 cplusplus = False
 '''bool: Default enable/disable C++ compiler'''
 
+python = False
+'''bool: Default enable/disable Python interpreter'''
+
 sourcext = []
 '''list: Default file extensions supported'''
 
+headerext = [".h", ".hpp", ".hh", ".hxx"]
+'''list: C/C++ header file extensions'''
+
 compiler = ''
 '''str: Default compiler'''
 
 buildflags = ''
 '''str: Default common compiler build flags'''
 
+progname = 'prog'
+'''str: Name of built program'''
+
+drivers = []
+'''list: Instructor driver/test sources linked with each lab (C++)'''
+
+pchheaders = []
+'''list: Common headers precompiled once and included in each lab build (C++)'''
+
+driverbuild = {}
+'''dict: Precompiled driver objects and flags, see prepareDriver()'''
+
+
+FICLONE = 0x40049409
+'''int: ioctl request to reflink (clone) a file, Linux'''
+
 
 # Global variables
 labdir = ''
@@ -77,6 +122,12 @@ studfile = ''
 studsel = ''
 '''str: Student ID to start processing'''
 
+studcols = ''
+'''str: Column mapping for CSV/TSV student files, e.g., 'sid=0,fn=1,ln=2' or header names'''
+
+studindex = {}
+'''dict: Student objects by ID'''
+
 infiles = []
 '''list: Input files for programs'''
 
@@ -92,6 +143,79 @@ clean = False
 proclist = []
 '''list: Subprocess handles, enable signal communication (e.g., kill)'''
 
+viewqueue = {}
+'''dict: Files pending to be opened, grouped by viewer command'''
+
+inputcache = {}
+'''dict: Contents of input files, each file is loaded once'''
+
+
+# Global batch options
+batch = False
+'''bool: Flag, if set grade labs without prompting (extract, build, autograde)'''
+
+njobs = 1
+'''int: Number of local worker processes for batch grading'''
+
+serveaddr = ''
+'''str: Address (host:port or socket path) where the coordinator serves work'''
+
+workeraddr = ''
+'''str: Address of coordinator to pull work from, if set run as worker'''
+
+authkey = ''
+'''str: Shared key between coordinator and workers, generated if not set'''
+
+outfiles = []
+'''list: Expected output files for programs, matched to input files by position'''
+
+runtimeout = 10
+'''int: Seconds a program can run during autograding before it is killed'''
+
+testjobs = 1
+'''int: Number of input files of a lab run concurrently during autograding'''
+
+workertimeout = 30
+'''int: Seconds without messages from a worker (sent every few seconds) before it is considered gone'''
+
+watchtime = 0
+'''int: Seconds between polls of labs directory for new/changed labs, 0 disables watching'''
+
+pywarm = False
+'''bool: Flag, if set Python programs run in pre-warmed interpreters (see pyserver.py)'''
+
+warmodules = ['math', 'random', 're', 'string', 'collections', 'itertools', 'functools',
+              'heapq', 'bisect', 'statistics', 'decimal', 'fractions', 'datetime', 'json',
+              'copy', 'typing', 'dataclasses']
+'''list: Modules pre-imported by warm Python interpreters'''
+
+pyserver = {}
+'''dict: Running Python server process ID, socket path and directory'''
+
+pyserverlock = threading.Lock()
+'''threading.Lock: Serializes Python server start/stop'''
+
+taskqueue = queue.Queue()
+'''queue.Queue: Students pending grading, served by coordinator to workers'''
+
+resultqueue = queue.Queue()
+'''queue.Queue: Messages streamed back by workers to coordinator'''
+
+batchconfig = {}
+'''dict: Build/grade options shared by coordinator with its workers'''
+
+stagehook = None
+'''callable: Called with (student ID, stage) as a lab is graded, workers report to coordinator'''
+
+showstatus = True
+'''bool: Flag, if set show live status view of batch grading in terminal'''
+
+metricsfile = ''
+'''str: File periodically rewritten with batch grading metrics'''
+
+persist = False
+'''bool: Flag, if set workers wait for more work instead of exiting (coordinator is watching)'''
+
 
 def parseArgs():
     '''
@@ -115,6 +239,11 @@ def parseArgs():
                         default='',
                         help='File with student info')
 
+    parser.add_argument('-k', '--columns', type=str, dest='studcols',
+                        default='',
+                        help='Column mapping for CSV/TSV student file\n'
+                             'e.g., \'sid=0,fn=1,ln=2\' or \'sid=ID,name=Student\'')
+
     parser.add_argument('-s', '--studsel', type=str, dest='studsel',
                         default='',
                         help='student ID to start processing')
@@ -134,16 +263,55 @@ def parseArgs():
                         dest='clean', help='clean (delete) all labs in working directory and exit')
     parser.add_argument('-p', '--compiler', type=str, default='g++',
                         dest='compiler', help='compiler program for building')
+    parser.add_argument('--driver', type=str, nargs='+', default='',
+                        dest='drivers', help='instructor driver/test sources linked with each lab\n'
+                                             '(compiled once and cached)')
+    parser.add_argument('--pch', type=str, nargs='+', default='',
+                        dest='pchheaders', help='common headers precompiled once and included in each lab build')
+    parser.add_argument('-o', '--outfiles', type=str, nargs='+', default='',
+                        dest='outfiles', help='expected outputs, matched to input files by position')
+    parser.add_argument('-t', '--timeout', type=int, default=10,
+                        dest='timeout', help='seconds a program can run during autograding')
+    parser.add_argument('--test-jobs', type=int, default=1,
+                        dest='testjobs', help='number of input files of a lab run concurrently during autograding')
+    parser.add_argument('--warm', action='store_true',
+                        dest='pywarm', help='run Python programs in pre-warmed interpreters')
+    parser.add_argument('-b', '--batch', action='store_true',
+                        dest='batch', help='grade labs without prompting (extract, build, autograde)')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        dest='njobs', help='number of local worker processes for batch grading')
+    parser.add_argument('--watch', type=int, nargs='?', const=30, default=0,
+                        dest='watchtime', help='keep grading new/changed labs, poll labdir every\n'
+                                               'WATCHTIME seconds (default 30)')
+    parser.add_argument('--no-status', action='store_false',
+                        dest='showstatus', help='do not show live status view during batch grading')
+    parser.add_argument('--metrics', type=str, default='',
+                        dest='metricsfile', help='file periodically rewritten with batch grading metrics\n'
+                                                 '(Prometheus text format)')
+    parser.add_argument('--serve', type=str, default='',
+                        dest='serveaddr', help='serve batch work queue at address (host:port or socket path)\n'
+                                               'remote workers must see the same labdir/input paths')
+    parser.add_argument('--worker', type=str, default='',
+                        dest='workeraddr', help='run as worker for coordinator at address (host:port or socket path)')
+    parser.add_argument('--authkey', type=str, default=os.environ.get('PGS_AUTHKEY', ''),
+                        dest='authkey', help='shared key between coordinator and workers\n'
+                                             '(default: PGS_AUTHKEY environment variable),\n'
+                                             'required to serve on a non-loopback address')
 
     args = parser.parse_args()
 
     # Set global variables with parsed arguments
-    global labdir, workdir, studfile, studsel, infiles, force, display, clean, compiler
+    global labdir, workdir, studfile, studsel, studcols, infiles, force, display, clean, compiler
     labdir = os.path.abspath(args.labdir)
     workdir = os.path.abspath(args.workdir)
     if args.studfile:
         studfile = os.path.abspath(args.studfile)
     studsel = args.studsel
+    studcols = args.studcols
+    try: parseColumns(studcols)
+    except ValueError as e:
+        print("*** Error: " + str(e) + " ***\n")
+        return False
     for ifile in args.infiles:
         infiles.append(os.path.abspath(ifile))
     force = args.force
@@ -151,13 +319,49 @@ def parseArgs():
     clean = args.clean
     compiler = args.compiler
 
+    # Set batch global variables
+    global batch, njobs, serveaddr, workeraddr, authkey, outfiles, runtimeout, testjobs, pywarm
+    global watchtime, drivers, pchheaders, showstatus, metricsfile
+    showstatus = args.showstatus
+    if args.metricsfile:
+        metricsfile = os.path.abspath(args.metricsfile)
+    for dfile in args.drivers:
+        drivers.append(os.path.abspath(dfile))
+    for hfile in args.pchheaders:
+        pchheaders.append(os.path.abspath(hfile))
+    for ofile in args.outfiles:
+        outfiles.append(os.path.abspath(ofile))
+    runtimeout = args.timeout
+    testjobs = max(1, args.testjobs)
+    pywarm = args.pywarm
+    serveaddr = args.serveaddr
+    workeraddr = args.workeraddr
+    authkey = args.authkey
+    watchtime = max(0, args.watchtime)
+    batch = args.batch or bool(serveaddr) or bool(watchtime)
+    njobs = args.njobs
+    if batch and not studfile:
+        print("*** Error: batch grading requires a student file ***\n")
+        return False
+    if njobs < 0 or (njobs == 0 and not serveaddr):
+        print("*** Error: batch grading requires at least one worker ***\n")
+        return False
+
+    # Work queue messages are pickled, only workers holding the key may connect
+    if workeraddr and not authkey:
+        print("*** Error: worker requires the coordinator key (--authkey or PGS_AUTHKEY) ***\n")
+        return False
+    if serveaddr and not authkey and not isLocalAddress(parseAddress(serveaddr)):
+        print("*** Error: serving on a network address requires --authkey or PGS_AUTHKEY ***\n")
+        return False
+
     # Build options for C++ and Python
     global cplusplus, python, sourcext, buildflags
     if compiler in ["g++"]:
         cplusplus = True
         python = False
         sourcext = [".cpp", ".c"]
-        buildflags = "-Wall -Wextra -pedantic -o prog"
+        buildflags = "-Wall -Wextra -pedantic"
     elif compiler in ["python3"]:
         cplusplus = False
         python = True
@@ -173,11 +377,13 @@ class Student(object):
     '''
     Student object
     '''
+    __slots__ = ('sid', 'fn', 'lab', 'pos')
+
     # Constructor
-    def __init__(self, sid='', fn='', labfile=[], pos=-1):
+    def __init__(self, sid='', fn='', labfile=None, pos=-1):
         self.sid = sid
         self.fn = fn
-        self.lab = labfile
+        self.lab = labfile if labfile is not None else []
         self.pos = pos
 
     # Print student info
@@ -199,62 +405,143 @@ def loadStudents():
     # Load students labs into local variable
     labs = os.listdir(labdir)
 
-    # Load students file contents into local variable
-    # Skip student entry if begins with '#'
-    studDB = []    # student entry database
-    studlist = []  # list of Student objects
-    if studfile:
-        fo = open(studfile, "r")
-        studDB = findPatterns(["^(?!\s*#+)"], fo.readlines())
-        fo.close()
-        print("Grading Program (auto mode)")
     # Run program manually
-    else:
+    if not studfile:
         print("Grading Program (manual mode)")
-        studlist.append(Student('unknown', 'Foo Bar', labs))
-
-    # Traverse each student file entry from database
-    pos = selflag = 0
-    for stud in studDB:
-        # Split student entry into form [ID, FIRSTNAME, LASTNAME]
-
-        # TODO: use delimited format (tsv or csv) to allow compound first and last names.
-        #sid, fn, ln = stud.split()
-        #name = fn + ' ' + ln
-
-        # NOTE: Temp fix to delimited format
-        studfields = stud.split()
-        nstudfields = len(studfields)
-        if nstudfields == 1:
-            sid = studfields
-            fn = ln = name = ''
-        elif nstudfields == 2:
-            sid, fn = studfields
-            ln = ''
-            name = fn
-        elif nstudfields == 3:
-            sid, fn, ln = studfields
-            name = fn + ' ' + ln
-        else:
-            sid, fn = studfields[0:2]
-            ln = ' '.join(studfields[2:nstudfields])
-            name = fn + ' ' + ln
-
-        # Load all students or Load selected student and all afterwards
-        if (not studsel) or (studsel and (findPatterns([studsel], [sid]) or selflag)):
-            # Search for current student lab based on the ID, use first match
-            lab = findPatterns([sid], labs)
-            labfile = [os.path.join(labdir, ''.join(l)) for l in lab] if lab else []
-
-            # Add Student object to list
-            sobj = Student(sid, name, labfile, pos)
+        return [Student('unknown', 'Foo Bar', [os.path.join(labdir, l) for l in labs])]
+    print("Grading Program (auto mode)")
+
+    # Stream student file entries into Student objects, indexed by ID
+    studlist = []  # list of Student objects
+    studindex.clear()
+    try:
+        for sid, name in iterRoster(studfile):
+            sobj = Student(sid, name, [], len(studlist))
             studlist.append(sobj)
-            pos = pos + 1
-            selflag = 1
+            studindex.setdefault(sid, sobj)
+    except (ValueError, csv.Error) as e:
+        print("*** Error: " + str(e) + " ***\n")
+        return []
+
+    # Load selected student and all afterwards
+    if studsel:
+        if studsel in studindex: start = studindex[studsel].pos
+        else:
+            start = len(studlist)
+            for stud in studlist:
+                if findPatterns([studsel], [stud.sid]):
+                    start = stud.pos
+                    break
+        studlist = studlist[start:]
+        for pos, stud in enumerate(studlist): stud.pos = pos
+
+    # Search for each student labs based on the ID
+    labindex = indexLabs(labs)
+    for stud in studlist:
+        stud.lab = [os.path.join(labdir, l) for l in findLabs(stud.sid, labs, labindex)]
 
     return studlist
 
 
+def iterRoster(rosterfile=''):
+    '''
+    Parse file with students info one entry at a time, yields (ID, name).
+    Entries beginning with '#' and blank lines are skipped.
+    CSV (.csv) and TSV (.tsv, .tab) files use the column mapping in 'studcols',
+    with index mappings a first row with an ID header (e.g., 'id', 'username') is skipped,
+    other files have whitespace separated entries of the form: ID FIRSTNAME LASTNAME...
+    '''
+    filext = os.path.splitext(rosterfile)[1].lower()
+    with open(rosterfile, 'r', newline='', encoding='utf-8-sig') as fo:  # BOM of Excel exports
+        entries = (l for l in fo if l.strip() and not l.lstrip().startswith('#'))
+
+        # Whitespace separated entries, last name may be compound
+        if filext not in [".csv", ".tsv", ".tab"]:
+            for entry in entries:
+                studfields = entry.split()
+                yield studfields[0], ' '.join(studfields[1:])
+            return
+
+        # Delimited entries, map columns by index or by header name
+        reader = csv.reader(entries, delimiter=',' if filext == ".csv" else '\t')
+        cols = parseColumns(studcols)
+        checkheader = all(isinstance(c, int) for c in cols.values())
+        if not checkheader:
+            header = [h.strip().lower() for h in next(reader, [])]
+            for key, col in cols.items():
+                if isinstance(col, int): continue
+                if col.lower() not in header:
+                    raise ValueError("column '" + col + "' not found in " + rosterfile)
+                cols[key] = header.index(col.lower())
+
+        for row in reader:
+            fields = {key: row[col].strip() if col < len(row) else '' for key, col in cols.items()}
+            if not fields['sid']: continue
+            if checkheader:
+                checkheader = False
+                if fields['sid'].lower() in ['id', 'sid', 'student id', 'studentid', 'student_id',
+                                             'student', 'username', 'user', 'netid', 'login',
+                                             'email']: continue
+            name = fields.get('name') or ' '.join(f for f in [fields.get('fn'), fields.get('ln')] if f)
+            yield fields['sid'], name
+
+
+def parseColumns(colspec=''):
+    '''
+    Parse column mapping of the form 'sid=0,fn=1,ln=2' where keys are
+    sid (ID), fn (first name), ln (last name) or name (full name) and
+    values are column indexes or header names.
+    '''
+    cols = {'sid': 0, 'fn': 1, 'ln': 2}
+    if colspec: cols = {}
+    for item in colspec.split(','):
+        if not item: continue
+        key, sep, col = item.partition('=')
+        key = key.strip().lower()
+        if not sep or key not in ['sid', 'fn', 'ln', 'name']:
+            raise ValueError("invalid column mapping '" + item + "'")
+        col = col.strip()
+        cols[key] = int(col) if col.isdigit() else col
+    if 'sid' not in cols: raise ValueError("column mapping requires 'sid'")
+    return cols
+
+
+def indexLabs(labs=[]):
+    '''
+    Index lab submission names by their alphanumeric tokens (lowercase).
+    Key '' maps 3-character substrings (lowercase) to names, for substring searches.
+    '''
+    labindex = {}
+    grams = {}
+    for l in labs:
+        name = l.lower()
+        for token in set(re.split("[^0-9a-z]+", name)):
+            if token: labindex.setdefault(token, []).append(l)
+        for gram in set(name[i:i + 3] for i in range(len(name) - 2)):
+            grams.setdefault(gram, []).append(l)
+    labindex[''] = grams
+    return labindex
+
+
+def findLabs(sid='', labs=[], labindex={}):
+    '''
+    Find lab submissions of a student ID using the token index, if none
+    match fall back to a case-insensitive substring search of all labs.
+    '''
+    key = sid.lower()
+    if re.fullmatch("[0-9a-z]+", key):
+        found = labindex.get(key, [])[:]
+        if found: return found
+    if not key: return []
+
+    # Only names with the least common substring of the ID can contain it
+    candidates = labs
+    if '' in labindex and len(key) >= 3:
+        candidates = min((labindex[''].get(key[i:i + 3], []) for i in range(len(key) - 2)),
+                         key=len)
+    return [l for l in candidates if key in l.lower()]
+
+
 def findPatterns(patterns=[], alist=[], mexact=0):
     '''
     Given a series of regex patterns remove all strings that match in the given list
@@ -321,6 +608,7 @@ def processStudents(studlist=None):
 
                 # Uncompress/copy lab and run
                 if extractLab(stud,i): processLab(stud)
+                viewerFlush()  # open files still queued when lab processing exits
                 os.chdir(workdir)  # move back to working directory
 
             # Close files opened for current user
@@ -373,9 +661,10 @@ def extractLab(stud=None,i=0):
         os.chdir(workdir) # move into working directory
 
     try:
-        # If not a compressed file, copy lab and move into it
+        # If not a compressed file, materialize lab and move into it
         if not filext:
-            shutil.copytree(studlab, rundir)
+            counts = materializeLab(studlab, rundir)
+            print("*** lab materialized: " + ", ".join([str(n) + ' ' + m for m, n in counts.items()]) + " ***")
             os.chdir(rundir)
         # If a ZIP file
         elif filext in [".zip"]:
@@ -416,10 +705,88 @@ def extractLab(stud=None,i=0):
     return True
 
 
+def materializeLab(src='', dst=''):
+    '''
+    Materialize a directory lab submission into a running directory without
+    copying data where possible. Directories are always private, so build
+    outputs never touch the submission. Files are shared, by preference:
+        * reflinked (copy-on-write clone), if the filesystem supports it
+        * hardlinked, if the submission file is read-only and not running as root
+          (writes fail instead of modifying it, editors that save by replacing get a private copy)
+        * copied in kernel (copy_file_range)
+    Keeping labs directory read-only makes this near-instant on any filesystem.
+    Returns dictionary with number of files per method.
+    '''
+    counts = {'reflinked': 0, 'hardlinked': 0, 'copied': 0}
+    reflink = True  # disabled at first unsupported clone
+    for root, dirs, files in os.walk(src, followlinks=True):
+        droot = os.path.join(dst, os.path.relpath(root, src))
+        os.makedirs(droot, exist_ok=True)
+        for afile in files:
+            srcfile = os.path.join(root, afile)
+            dstfile = os.path.join(droot, afile)
+            st = os.stat(srcfile)
+
+            # Clone
+            if reflink:
+                try:
+                    cloneFile(srcfile, dstfile, st)
+                    counts['reflinked'] = counts['reflinked'] + 1
+                    continue
+                except OSError as e:
+                    if os.path.exists(dstfile): os.remove(dstfile)
+                    if e.errno not in [errno.EOPNOTSUPP, errno.EXDEV, errno.EINVAL, errno.ENOTTY]: raise
+                    reflink = False
+
+            # Share read-only file, permissions do not protect it from root
+            if not st.st_mode & (stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH) and os.geteuid() != 0:
+                try:
+                    os.link(srcfile, dstfile)
+                    counts['hardlinked'] = counts['hardlinked'] + 1
+                    continue
+                except OSError as e:
+                    if e.errno not in [errno.EXDEV, errno.EPERM, errno.EMLINK]: raise
+
+            copyFile(srcfile, dstfile, st)
+            counts['copied'] = counts['copied'] + 1
+    return counts
+
+
+def cloneFile(srcfile='', dstfile='', st=None):
+    '''
+    Create a reflink (copy-on-write clone) of a file, raises OSError if not supported
+    '''
+    with open(srcfile, 'rb') as sfd, open(dstfile, 'wb') as dfd:
+        fcntl.ioctl(dfd.fileno(), FICLONE, sfd.fileno())
+    os.chmod(dstfile, stat.S_IMODE(st.st_mode))
+    os.utime(dstfile, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+
+def copyFile(srcfile='', dstfile='', st=None):
+    '''
+    Copy a file in kernel with copy_file_range (may share extents on
+    filesystems that support it), falls back to a regular copy
+    '''
+    with open(srcfile, 'rb') as sfd, open(dstfile, 'wb') as dfd:
+        try:
+            remaining = st.st_size
+            while remaining > 0:
+                n = os.copy_file_range(sfd.fileno(), dfd.fileno(), remaining)
+                if n == 0: break
+                remaining = remaining - n
+        except (OSError, AttributeError):
+            sfd.seek(0)
+            dfd.seek(0)
+            dfd.truncate()
+            shutil.copyfileobj(sfd, dfd)
+    os.chmod(dstfile, stat.S_IMODE(st.st_mode))
+    os.utime(dstfile, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+
 def viewerSelect(afile=''):
     '''
     Given a file, use its extension to select a viewer program for opening the file.
-    The function builds a command line string that is executed via system command.
+    The file is queued with other files of the same viewer, see viewerFlush().
     '''
     # Parse file extension
     filenm, filext = os.path.splitext(afile)
@@ -467,18 +834,352 @@ def viewerSelect(afile=''):
         #viewer = "notepad++"
         #opts = "-lnormal"
 
-    # Open file, redirect stdout/stderr to /dev/null
-    cmd = "\"" + viewer + "\" " + opts + " \"" + afile + "\""
-    proclist.append(subprocess.Popen(cmd, stdout=subprocess.DEVNULL,
-                                     stderr=subprocess.DEVNULL, shell=True))
+    # Queue file, absolute path because lab traversal changes directories
+    cmd = tuple([viewer] + opts.split())
+    viewqueue.setdefault(cmd, []).append(os.path.abspath(afile))
+
+
+def viewerFlush():
+    '''
+    Open all queued files, a single viewer process per viewer type.
+    Viewers that keep a running instance (e.g., gedit) reuse it.
+    '''
+    subprocreap(proclist)
+    for cmd, files in viewqueue.items():
+        # Open files, redirect stdout/stderr to /dev/null
+        try:
+            proclist.append(subprocess.Popen(list(cmd) + files, stdout=subprocess.DEVNULL,
+                                             stderr=subprocess.DEVNULL))
+        except OSError:
+            print("*** Warning: failed to launch viewer " + cmd[0] + " ***\n")
+    viewqueue.clear()
+
+
+class ExecResult(object):
+    '''
+    Result of a command run with execCommand()
+    '''
+    # Constructor
+    def __init__(self, argv=[]):
+        self.argv = argv
+        self.pid = -1
+        self.returncode = None  # exit code, negative signal number if killed
+        self.signal = 0         # signal that terminated the program, if any
+        self.timedout = False
+        self.stdout = b''
+        self.stderr = b''
+        self.elapsed = 0.0      # wall time, seconds
+        self.utime = 0.0        # user CPU time, seconds
+        self.stime = 0.0        # system CPU time, seconds
+
+    # Check if program finished successfully
+    def ok(self):
+        return self.returncode == 0 and not self.timedout
+
+    # Print how program finished, if not successfully
+    def print(self):
+        if self.timedout: print("*** program killed, time limit exceeded ***")
+        elif self.signal: print("*** program terminated by signal " + str(self.signal) + " ***")
+        elif self.returncode: print("*** program exit code " + str(self.returncode) + " ***")
+
+
+def loadInput(infile=''):
+    '''
+    Get contents of an input file, files are read once and kept in memory
+    '''
+    if infile not in inputcache:
+        with open(infile, 'rb') as fd: inputcache[infile] = fd.read()
+    return inputcache[infile]
+
+
+def execCommand(argv=[], inbuf=None, capture=False, merge=False, timeout=None):
+    '''
+    Run a command (argument list) without a shell via posix_spawn.
+    Standard input is fed from 'inbuf' (bytes), it is inherited if None.
+    If 'capture' is set, stdout/stderr are collected ('merge' sends stderr to stdout),
+    otherwise they are inherited. Returns an ExecResult.
+    '''
+    result = ExecResult(argv)
+    childfds, infd, outfds = openPipes(inbuf, capture, merge)
+    fdactions = [(os.POSIX_SPAWN_DUP2, fd, i) for i, fd in enumerate(childfds) if fd is not None]
+
+    tstart = time.perf_counter()
+    try:
+        # Python ignores SIGPIPE, restore default for child
+        result.pid = os.posix_spawnp(argv[0], argv, os.environ, file_actions=fdactions,
+                                     setsigdef=[signal.SIGPIPE])
+    except:
+        for fd in [infd] + list(outfds):
+            if fd is not None: os.close(fd)
+        raise
+    finally:
+        for fd in set(childfds) - {None}: os.close(fd)
+
+    deadline = None if timeout is None else tstart + timeout
+    try:
+        chunks = pumpPipes(result, infd, outfds, inbuf, deadline)
+        status, rusage = waitChild(result, deadline)
+    except BaseException:
+        # Do not leave child running (e.g., KeyboardInterrupt)
+        os.kill(result.pid, signal.SIGKILL)
+        os.waitpid(result.pid, 0)
+        raise
+
+    result.elapsed = time.perf_counter() - tstart
+    for fd, name in outfds.items(): setattr(result, name, b''.join(chunks[fd]))
+    setStatus(result, status, rusage.ru_utime, rusage.ru_stime)
+    return result
+
+
+def openPipes(inbuf=None, capture=False, merge=False):
+    '''
+    Create pipes for running a program, see execCommand().
+    Returns child ends for stdin/stdout/stderr (None if inherited),
+    parent end of stdin and dictionary of parent output ends --> result attribute.
+    '''
+    childfds = [None, None, None]
+    infd = None
+    outfds = {}
+    if inbuf is not None:
+        childfds[0], infd = os.pipe()
+    if capture:
+        rfd, childfds[1] = os.pipe()
+        outfds[rfd] = 'stdout'
+        if merge: childfds[2] = childfds[1]
+        else:
+            rfd, childfds[2] = os.pipe()
+            outfds[rfd] = 'stderr'
+    return childfds, infd, outfds
+
+
+def setStatus(result=None, status=0, utime=0.0, stime=0.0):
+    '''
+    Set exit code/signal and CPU times of a finished program
+    '''
+    result.utime = utime
+    result.stime = stime
+    if os.WIFSIGNALED(status):
+        result.signal = os.WTERMSIG(status)
+        result.returncode = -result.signal
+    else:
+        result.returncode = os.WEXITSTATUS(status)
+
+
+def pumpPipes(result=None, infd=None, outfds={}, inbuf=b'', deadline=None, kill=None):
+    '''
+    Write input buffer to child stdin pipe and read its output pipes
+    until they close or deadline passes (child is then killed, by 'kill'
+    function if given). Returns dictionary of output chunks per pipe.
+    '''
+    chunks = {fd: [] for fd in outfds}
+    sel = selectors.DefaultSelector()
+    if infd is not None:
+        if inbuf:
+            os.set_blocking(infd, False)
+            sel.register(infd, selectors.EVENT_WRITE)
+        else: os.close(infd)  # empty input, send EOF
+    for fd in outfds: sel.register(fd, selectors.EVENT_READ)
+
+    view = memoryview(inbuf or b'')
+    offset = 0
+    try:
+        while sel.get_map():
+            wait = None if deadline is None else deadline - time.perf_counter()
+            if wait is not None and wait <= 0:
+                result.timedout = True
+                if kill is None: os.kill(result.pid, signal.SIGKILL)
+                else: kill()
+                break
+            for key, events in sel.select(wait):
+                if key.fd == infd:
+                    try:
+                        offset = offset + os.write(infd, view[offset:offset + 65536])
+                    except BrokenPipeError:
+                        offset = len(view)  # child stopped reading
+                    if offset >= len(view):
+                        sel.unregister(infd)
+                        os.close(infd)
+                else:
+                    data = os.read(key.fd, 65536)
+                    if data: chunks[key.fd].append(data)
+                    else:
+                        sel.unregister(key.fd)
+                        os.close(key.fd)
+    finally:
+        for key in list(sel.get_map().values()): os.close(key.fd)
+        sel.close()
+    return chunks
+
+
+def waitChild(result=None, deadline=None):
+    '''
+    Wait for child to exit, killing it if deadline passes.
+    Returns exit status and resource usage.
+    '''
+    while deadline is not None and not result.timedout:
+        pid, status, rusage = os.wait4(result.pid, os.WNOHANG)
+        if pid: return status, rusage
+        if time.perf_counter() >= deadline:
+            result.timedout = True
+            os.kill(result.pid, signal.SIGKILL)
+        else: time.sleep(0.005)
+    pid, status, rusage = os.wait4(result.pid, 0)
+    return status, rusage
+
+
+def startPyServer():
+    '''
+    Start pre-warmed Python interpreter server (pyserver.py) with the
+    selected interpreter, if not running. Stopped when program exits.
+    '''
+    with pyserverlock:
+        if pyserver: return
+        sockdir = tempfile.mkdtemp(prefix="pgs-")
+        sockpath = os.path.join(sockdir, "py.sock")
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pyserver.py")
+        argv = [compiler, script, sockpath] + warmodules
+        pid = os.posix_spawnp(argv[0], argv, os.environ, setsid=True,
+                              file_actions=[(os.POSIX_SPAWN_OPEN, 0, os.devnull, os.O_RDONLY, 0)])
+
+        # Wait for server to listen
+        tstart = time.time()
+        while not os.path.exists(sockpath):
+            if os.waitpid(pid, os.WNOHANG)[0] or time.time() - tstart > 10:
+                shutil.rmtree(sockdir)
+                raise OSError("failed to start Python server")
+            time.sleep(0.01)
+        pyserver.update({'pid': pid, 'sock': sockpath, 'dir': sockdir})
+        atexit.register(stopPyServer)
+
+
+def stopPyServer():
+    '''
+    Stop pre-warmed Python interpreter server
+    '''
+    with pyserverlock:
+        if not pyserver: return
+        os.kill(pyserver['pid'], signal.SIGTERM)
+        os.waitpid(pyserver['pid'], 0)
+        shutil.rmtree(pyserver['dir'], ignore_errors=True)
+        pyserver.clear()
+
+
+def recvLine(conn=None, buf=None):
+    '''
+    Read a line from socket, 'buf' keeps data received past it (and
+    partial data if interrupted by a timeout). Returns empty if connection closed.
+    '''
+    while b'\n' not in buf:
+        data = conn.recv(4096)
+        if not data: return b''
+        buf.extend(data)
+    end = buf.index(b'\n') + 1
+    line = bytes(buf[:end])
+    del buf[:end]
+    return line
+
+
+def execWarm(argv=[], inbuf=None, capture=False, merge=False, timeout=None):
+    '''
+    Run a Python program ([interpreter, script, args...]) in a pre-warmed
+    interpreter forked by the Python server, see pyserver.py.
+    Arguments and result are the same as execCommand().
+    '''
+    startPyServer()
+    result = ExecResult(argv)
+    childfds, infd, outfds = openPipes(inbuf, capture, merge)
+    childfds = [i if fd is None else fd for i, fd in enumerate(childfds)]  # inherit 0/1/2
+
+    tstart = time.perf_counter()
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.connect(pyserver['sock'])
+        req = {'script': argv[1], 'args': argv[2:], 'cwd': os.getcwd()}
+        socket.send_fds(conn, [json.dumps(req).encode() + b'\n'], childfds)
+        connbuf = bytearray()
+        msg = recvLine(conn, connbuf)
+        if not msg: raise OSError("Python server failed to run " + argv[1])
+        result.pid = json.loads(msg)['pid']
+    except:
+        conn.close()
+        for fd in [infd] + list(outfds):
+            if fd is not None: os.close(fd)
+        raise
+    finally:
+        for fd in set(childfds) - {0, 1, 2}: os.close(fd)
+
+    # Supervisor kills the program, it owns (reaps) its process ID
+    def kill():
+        try: conn.sendall(b'kill\n')
+        except OSError: pass  # supervisor already exited
+
+    deadline = None if timeout is None else tstart + timeout
+    try:
+        chunks = pumpPipes(result, infd, outfds, inbuf, deadline, kill)
+        # Wait for exit status reported by supervisor
+        msg = b''
+        if deadline is not None and not result.timedout:
+            conn.settimeout(max(0, deadline - time.perf_counter()))
+            try: msg = recvLine(conn, connbuf)
+            except socket.timeout:
+                result.timedout = True
+                kill()
+        if not msg:
+            conn.settimeout(None)
+            msg = recvLine(conn, connbuf)
+        if not msg: raise OSError("Python server failed to run " + argv[1])
+    except BaseException:
+        # Do not leave program running (e.g., KeyboardInterrupt)
+        kill()
+        raise
+    finally:
+        conn.close()
+
+    result.elapsed = time.perf_counter() - tstart
+    for fd, name in outfds.items(): setattr(result, name, b''.join(chunks[fd]))
+    status = json.loads(msg)
+    setStatus(result, status['status'], status['utime'], status['stime'])
+    return result
+
+
+def execProgram(**kwargs):
+    '''
+    Run a student program, Python programs use pre-warmed interpreters if enabled.
+    Takes the same keyword arguments as execCommand().
+    '''
+    if python and pywarm and kwargs['argv'][0] == compiler: return execWarm(**kwargs)
+    return execCommand(**kwargs)
+
+
+async def execCommandAsync(runner=None, **kwargs):
+    '''
+    Asyncio interface of execCommand(), takes the same keyword arguments.
+    Another function with same interface can be used as 'runner'.
+    '''
+    return await asyncio.to_thread(runner or execCommand, **kwargs)
+
+
+def execBatch(jobs=[], maxjobs=1, runner=None):
+    '''
+    Run commands concurrently with at most 'maxjobs' running at a time.
+    Each job is a dictionary of execCommand() keyword arguments.
+    Returns list of ExecResult in same order as jobs.
+    '''
+    async def runJobs():
+        sem = asyncio.Semaphore(maxjobs)
+        async def runJob(job):
+            async with sem: return await execCommandAsync(runner, **job)
+        return await asyncio.gather(*[runJob(job) for job in jobs])
+    return asyncio.run(runJobs())
 
 
-def compileLab(afile='', inc=''):
+def compileLab(srcfiles=[], incdirs=[]):
     '''
-    Compile lab source codes, one source file at a time
+    Compile lab source codes and run program
     '''
     # Only use include directories for C++ programs
-    if not cplusplus: inc = ''
+    if not cplusplus: incdirs = []
+    afile = ' '.join(srcfiles)
 
     # Set attempt limit for compiling program
     maxattempts = 3;
@@ -525,34 +1226,107 @@ def compileLab(afile='', inc=''):
                     break
 
                 # Compile and run program
-                cmd = compiler + ' ' + buildflags + ' ' + inc + ' ' + afile
-                print("\n*** compiling: " + cmd + " ***\n")
+                cmd = buildCommand(srcfiles, incdirs)
+                inbuf = loadInput(infile) if infile else None
+                print("\n*** compiling: " + shlex.join(cmd) + " ***\n")
                 if cplusplus:
-                    if not os.system(cmd):
-                        progname = "prog"
-                        cmd2 = "./" + progname
-                        if infile:
-                            ifd = open(infile, 'r')
-                            subprocess.run(cmd2, stdin=ifd, shell=True)
-                            ifd.close()
-                        else:
-                            subprocess.run(cmd2, shell=True)
+                    if execCommand(cmd).ok():
+                        execCommand(["./" + progname], inbuf).print()
                         os.remove(progname)
                         attempts = 0;
                         print()
                     else:
                         attempts = attempts + 1
                 elif python:
-                    subprocess.run(cmd, shell=True)
-                    print()
-                else:
-                    os.system(cmd)
+                    execProgram(argv=cmd, inbuf=inbuf).print()
                     print()
         except:
             print("\n*** Error: compile/run failed for " + afile + " ***\n")
             attempts = attempts + 1
 
 
+def buildCommand(srcfiles=[], incdirs=[], prog=''):
+    '''
+    Command (list) to build lab sources. C++ programs are linked with the
+    precompiled instructor driver and include precompiled headers, if any.
+    '''
+    if not cplusplus: return [compiler] + shlex.split(buildflags) + srcfiles
+    driver = prepareDriver()
+    return ([compiler] + shlex.split(buildflags) + driver['flags']
+            + ['-I' + d for d in list(incdirs) + driver['incdirs']]
+            + srcfiles + driver['objs'] + ['-o', prog or progname])
+
+
+def prepareDriver():
+    '''
+    Compile instructor driver sources into objects and precompile common
+    headers, once. Builds are cached in '.pgs_cache' of working directory,
+    keyed by compiler, build flags and contents of driver sources/headers
+    and the local headers they include.
+    Returns dictionary with driver objects, include directories and flags.
+    '''
+    if driverbuild: return driverbuild
+    build = {'objs': [], 'incdirs': [], 'flags': []}
+    if not drivers and not pchheaders:
+        driverbuild.update(build)
+        return driverbuild
+
+    build['incdirs'] = sorted(set(os.path.dirname(afile) for afile in drivers + pchheaders))
+    incflags = shlex.split(buildflags) + ['-I' + d for d in build['incdirs']]
+
+    # Cache key, includes local headers of driver sources/headers (e.g., an API header)
+    key = hashlib.sha1()
+    comppath = shutil.which(compiler) or compiler
+    key.update((comppath + str(os.path.getmtime(comppath)) + buildflags).encode())
+    for afile in drivers + pchheaders:
+        deps = [afile]
+        res = execCommand([compiler] + incflags + ['-MM', afile], b'', capture=True)
+        if res.ok():
+            rule = res.stdout.decode(errors='replace').replace('\\\n', ' ').partition(': ')[2]
+            deps = deps + sorted(set(d.replace('\\ ', ' ')
+                                     for d in re.split(r'(?<!\\)\s+', rule.strip()) if d))
+        for dep in deps:
+            key.update(os.path.abspath(dep).encode())
+            with open(dep, 'rb') as fd: key.update(fd.read())
+    cachedir = os.path.join(workdir, ".pgs_cache", key.hexdigest())
+
+    # Precompiled headers are used via a header including all common headers
+    pchfile = os.path.join(cachedir, "pgs_pch.h")
+    if pchheaders: build['flags'] = ['-include', pchfile]
+    build['objs'] = [os.path.join(cachedir, str(i) + '_' + os.path.splitext(os.path.basename(afile))[0] + ".o")
+                     for i, afile in enumerate(drivers)]
+
+    # Build into temporary directory, then publish it (other workers may race)
+    if not os.path.exists(cachedir):
+        print("*** compiling instructor driver: " + cachedir + " ***\n")
+        os.makedirs(os.path.dirname(cachedir), exist_ok=True)
+        tmpdir = tempfile.mkdtemp(dir=os.path.dirname(cachedir))
+        try:
+            flags = incflags
+            cmds = []
+            if pchheaders:
+                tmppch = os.path.join(tmpdir, "pgs_pch.h")
+                with open(tmppch, 'w') as fd:
+                    for hfile in pchheaders: fd.write("#include \"" + hfile + "\"\n")
+                cmds.append([compiler] + flags + ['-x', 'c++-header', tmppch, '-o', tmppch + ".gch"])
+                flags = ['-include', tmppch] + flags
+            for afile, obj in zip(drivers, build['objs']):
+                cmds.append([compiler] + flags + ['-c', afile, '-o',
+                                                  os.path.join(tmpdir, os.path.basename(obj))])
+            for cmd in cmds:
+                res = execCommand(cmd, b'', capture=True, merge=True)
+                if not res.ok():
+                    print(res.stdout.decode(errors='replace'))
+                    raise RuntimeError("failed to compile instructor driver: " + shlex.join(cmd))
+            try: os.rename(tmpdir, cachedir)
+            except OSError: pass  # already published
+        finally:
+            if os.path.exists(tmpdir): shutil.rmtree(tmpdir)
+
+    driverbuild.update(build)
+    return driverbuild
+
+
 def parseRelPaths(root='', basepaths=[], rellists=[], dir_file='', mexact=0):
     '''
     Parse a root path based on a match with a base path to obtain a relative path.
@@ -583,19 +1357,33 @@ def processLab(stud=None):
     partfiles = [[] for i in range(2)]  # store source files for lab parts
     partbases = []  # store the base directories for lab parts
 
+    # Propose compilation units detected in lab, otherwise mark parts manually
+    top = os.getcwd()
+    units = scanUnits(top)
+    autounits = False
+    if units:
+        printUnits(units)
+        iquery = "USE DETECTED UNITS? [y]es, [n]o (mark manually), e[x]it: "
+        res = input(iquery).lower()
+        while not res in ['y', 'n', 'x']:
+            res = input(iquery).lower()
+        if res in ['x']: return  # exit processing lab
+        autounits = res in ['y']
+
     # Check if current directory is itself a lab part
-    print()
-    if len(os.listdir()) > 0:
-        print(os.path.basename(os.getcwd()) + '/' + str(os.listdir()))
-    iquery = "USE DIRECTORY? [y]es, [n]o, [c]ompile, e[x]it --> " + os.path.basename(os.getcwd()) + ": "
-    res = input(iquery).lower()
-    while not res in ['y', 'n', 'c', 'x']:
+    if not autounits:
+        print()
+        if len(os.listdir()) > 0:
+            print(os.path.basename(os.getcwd()) + '/' + str(os.listdir()))
+        iquery = "USE DIRECTORY? [y]es, [n]o, [c]ompile, e[x]it --> " + os.path.basename(os.getcwd()) + ": "
         res = input(iquery).lower()
-    if res in ['c']:  # consider subdirectory as a compilation part
-        partdirs[pidx].append(os.getcwd())    # add to top parts directories
-        partbases.append(os.path.basename(os.getcwd()))  # add to base parts directories
-        pidx = pidx + 1  # part number
-    elif res in ['n', 'x']: return  # exit processing lab
+        while not res in ['y', 'n', 'c', 'x']:
+            res = input(iquery).lower()
+        if res in ['c']:  # consider subdirectory as a compilation part
+            partdirs[pidx].append(os.getcwd())    # add to top parts directories
+            partbases.append(os.path.basename(os.getcwd()))  # add to base parts directories
+            pidx = pidx + 1  # part number
+        elif res in ['n', 'x']: return  # exit processing lab
 
     # Traverse the lab directory tree
     for root, dirs, files in os.walk(os.getcwd()):
@@ -613,8 +1401,8 @@ def processLab(stud=None):
         #print()
         #if len(dirs) > 0: print(troot + '/' + str(dirs))
 
-        # Traverse subdirectories to prune
-        tdirs = dirs[:]  # get copy of subdirectory list, slice
+        # Traverse subdirectories to prune, not needed if using detected units
+        tdirs = dirs[:] if not autounits else []  # get copy of subdirectory list, slice
         for d in tdirs:
             # Print files inside current directory
             print()
@@ -650,19 +1438,145 @@ def processLab(stud=None):
             filenm, filext = os.path.splitext(afile)
             filext = filext.lower()
             print(pidx)
-            if filext in sourcext:
-                if not pidx: compileLab('\"' + afile + '\"')
+            if filext in sourcext and not autounits:
+                if not pidx:
+                    viewerFlush()  # show selected files before running
+                    compileLab([afile])
                 else: parseRelPaths(troot, partbases, partfiles, afile, 1)
 
+        # Open files selected in current directory
+        viewerFlush()
+
+    # Compile each detected unit
+    if autounits:
+        viewerFlush()  # show selected files before running
+        os.chdir(top)
+        for i, unit in enumerate(units):
+            print("\nCompiling lab unit " + str(i+1) + ": " + (unit['main'] or "no main"))
+            compileLab(unit['srcfiles'], unit['incdirs'])
+
     # Compile each lab part, if necessary
     for i in range(pidx):
         print("\nCompiling lab part " + str(i+1))
         os.chdir(partdirs[i][0])
 
-        # Concatenate include directories and source files
-        incdirs = '-I\"' + '\" -I\"'.join(partdirs[i][:]) + '\"'
-        srcfiles = '\"' + '\" \"'.join(partfiles[i]) + '\"'
-        compileLab(srcfiles, incdirs)
+        compileLab(partfiles[i], partdirs[i])
+
+
+def scanUnits(top='.'):
+    '''
+    Detect compilation units of a lab. Indexes source/header files, finds
+    'main' entry points and local '#include' relationships. A unit has a main
+    source, the sources implementing headers it includes (same file name)
+    and include directories. If no main is found or an instructor driver
+    provides it, a single unit has all sources without a main.
+    Returns list of units (dictionaries), paths are relative to 'top'.
+    '''
+    if cplusplus: mainregex = re.compile(r"^\s*(?:int|void|auto)\s+main\s*\(", re.MULTILINE)
+    else: mainregex = re.compile(r"__name__\s*==\s*['\"]__main__['\"]")
+    incregex = re.compile(r'^\s*#\s*include\s*"([^"]+)"', re.MULTILINE)
+
+    # Index sources/headers: path --> (has main, local includes)
+    index = {}
+    bybase = {}  # file name --> paths
+    bystem = {}  # source name without extension --> paths
+    for root, dirs, files in os.walk(top):
+        for p in set(findPatterns(["^(\s*[.~]+)", "MACOSX"], dirs)): dirs.remove(p)
+        dirs.sort()
+        for afile in sorted(files):
+            filenm, filext = os.path.splitext(afile)
+            filext = filext.lower()
+            if afile.startswith(('.', '~')): continue
+            if not (filext in sourcext or (cplusplus and filext in headerext)): continue
+            path = os.path.relpath(os.path.join(root, afile), top)
+            with open(os.path.join(top, path), 'r', errors='replace') as fd: text = fd.read()
+            ismain = bool(mainregex.search(text)) or (python and afile == "main.py")
+            index[path] = (ismain and filext in sourcext, incregex.findall(text) if cplusplus else [])
+            bybase.setdefault(afile, []).append(path)
+            if filext in sourcext: bystem.setdefault(filenm, []).append(path)
+
+    # Number of leading directories shared by two paths
+    def shared(a, b):
+        n = 0
+        for x, y in zip(os.path.dirname(a).split(os.sep), os.path.dirname(b).split(os.sep)):
+            if x != y or not x: break
+            n = n + 1
+        return n
+
+    # Resolve local include relative to including file, else anywhere
+    # in lab, closest first (needs include directory). Returns (path, include directory).
+    def resolve(path, inc):
+        inc = os.path.normpath(inc)
+        hdr = os.path.normpath(os.path.join(os.path.dirname(path), inc))
+        if hdr in index: return hdr, ''
+        for cand in sorted(bybase.get(os.path.basename(inc), []), key=lambda c: -shared(c, path)):
+            if cand == inc or cand.endswith(os.sep + inc):
+                return cand, cand[:-len(inc)].rstrip(os.sep) or '.'
+        return None, ''
+
+    sources = [path for path in index if os.path.splitext(path)[1].lower() in sourcext]
+    mains = [path for path in sources if index[path][0]]
+    if not sources: return []
+
+    # Single unit, main comes from driver (or is missing)
+    if (cplusplus and drivers) or not mains:
+        if python: return [{'main': sources[0], 'srcfiles': sources[:1], 'incdirs': []}]
+        srcfiles = [path for path in sources if not index[path][0]] if drivers else sources
+        incdirs = set(resolve(path, inc)[1] for path in index for inc in index[path][1])
+        return [{'main': '', 'srcfiles': srcfiles, 'incdirs': sorted(incdirs - {''})}] if srcfiles else []
+
+    # Python programs only need main script
+    mains.sort(key=lambda path: (os.path.splitext(os.path.basename(path))[0] != "main",
+                                 path.count(os.sep), path))
+    if python: return [{'main': path, 'srcfiles': [path], 'incdirs': []} for path in mains]
+
+    # Follow local includes from each main
+    units = []
+    for main in mains:
+        # Directories of other mains, unless they also contain this main
+        maindir = os.path.dirname(main)
+        otherdirs = set(os.path.dirname(m) for m in mains if m != main)
+        otherdirs = [d for d in otherdirs if d and d != maindir and
+                     not maindir.startswith(d + os.sep)]
+        srcfiles = [main]
+        incdirs = set()
+        seen = {main}
+        todo = [main]
+        while todo:
+            path = todo.pop()
+            for inc in index[path][1]:
+                hdr, incdir = resolve(path, inc)
+                if incdir: incdirs.add(incdir)
+                if hdr is None or hdr in seen: continue
+                seen.add(hdr)
+                todo.append(hdr)
+                if hdr in sources: continue  # included source
+
+                # Implementation of header, not from another main's directory,
+                # closest to header and then to main
+                stem = os.path.splitext(os.path.basename(hdr))[0]
+                impls = [src for src in bystem.get(stem, [])
+                         if not any(src.startswith(d + os.sep) for d in otherdirs)]
+                impls.sort(key=lambda src: (-shared(src, hdr), -shared(src, main), src))
+                for src in impls[:1]:
+                    if src in seen or index[src][0]: continue
+                    seen.add(src)
+                    srcfiles.append(src)
+                    todo.append(src)
+        units.append({'main': main, 'srcfiles': srcfiles, 'incdirs': sorted(incdirs)})
+    return units
+
+
+def printUnits(units=[]):
+    '''
+    Print compilation units detected by scanUnits()
+    '''
+    print("\nDetected compilation units:")
+    for i, unit in enumerate(units):
+        incs = ''.join([' -I' + d for d in unit['incdirs']])
+        print("  " + str(i+1) + ". " + (unit['main'] or "no main") + " --> " +
+              ' '.join(unit['srcfiles']) + incs)
+    print()
 
 
 def subprockill(plist):
@@ -670,6 +1584,611 @@ def subprockill(plist):
     Kill all active child processes
     '''
     for p in plist: p.kill()
+    for p in plist: p.wait()
+    del plist[:]
+
+
+def subprocreap(plist):
+    '''
+    Remove finished child processes from list, reaping them
+    '''
+    plist[:] = [p for p in plist if p.poll() is None]
+
+
+def findSources(top='.'):
+    '''
+    Walk a lab directory and list its source files (relative paths),
+    skipping hidden/temporary/MACOSX directories and files.
+    '''
+    srcfiles = []
+    for root, dirs, files in os.walk(top):
+        for p in set(findPatterns(["^(\s*[.~]+)", "MACOSX"], dirs)): dirs.remove(p)
+        dirs.sort()
+        for p in set(findPatterns(["^(\s*[.~]+)"], files)): files.remove(p)
+        for afile in sorted(files):
+            filenm, filext = os.path.splitext(afile)
+            if filext.lower() in sourcext:
+                srcfiles.append(os.path.relpath(os.path.join(root, afile), top))
+    return srcfiles
+
+
+def buildLab():
+    '''
+    Build lab in current directory without prompting.
+    Compiler messages are kept in 'pgs_build.log'.
+    Returns command (list) to run the program, empty if build failed.
+    '''
+    units = scanUnits()
+    if not units: return []
+
+    if cplusplus:
+        # Each unit is a program (prog, prog2, ...), first one is autograded
+        cmds = [buildCommand(unit['srcfiles'], unit['incdirs'], progname + (str(i+1) if i else ''))
+                for i, unit in enumerate(units)]
+        runcmd = ["./" + progname]
+    elif python:
+        # Byte-compile all scripts, run first main script
+        cmds = [[compiler, "-m", "py_compile"] + findSources()]
+        runcmd = [compiler, units[0]['main']]
+
+    ok = True
+    with open("pgs_build.log", 'wb') as fd:
+        for cmd in cmds:
+            res = execCommand(cmd, b'', capture=True, merge=True)
+            fd.write(("*** " + shlex.join(cmd) + " ***\n").encode() + res.stdout)
+            ok = ok and res.ok()
+    return runcmd if ok else []
+
+
+def sameOutput(output=b'', expfile=''):
+    '''
+    Compare program output with expected output file,
+    ignoring trailing whitespace and trailing blank lines.
+    '''
+    with open(expfile, 'rb') as fd: expected = fd.read()
+    return [l.rstrip() for l in output.rstrip().splitlines()] == \
+           [l.rstrip() for l in expected.rstrip().splitlines()]
+
+
+def autogradeLab(runcmd=[]):
+    '''
+    Run built lab once per input file (once without input if none given)
+    and compare with expected outputs, if any.
+    Program outputs are kept as 'pgs_out<N>.txt'.
+    Returns number of tests passed.
+    '''
+    jobs = [{'argv': runcmd, 'inbuf': loadInput(infile) if infile else b'',
+             'capture': True, 'merge': True, 'timeout': runtimeout}
+            for infile in (infiles or [''])]
+
+    passed = 0
+    for k, res in enumerate(execBatch(jobs, testjobs, execProgram)):
+        with open("pgs_out" + str(k) + ".txt", 'wb') as fd: fd.write(res.stdout)
+        ok = res.ok()
+        if ok and k < len(outfiles): ok = sameOutput(res.stdout, outfiles[k])
+        if ok: passed = passed + 1
+    return passed
+
+
+def gradeLab(stud=None, i=0):
+    '''
+    Uncompress/copy, build and autograde a lab submission without prompting.
+    Returns a dictionary with the grading results.
+    '''
+    os.chdir(workdir)  # move to working directory
+
+    result = {'sid': stud.sid, 'name': stud.fn, 'lab': '', 'status': 'missing',
+              'passed': 0, 'total': len(infiles) or 1, 'worker': workerId(),
+              'elapsed': 0.0}
+    if not stud.lab: return result
+    result['lab'] = os.path.basename(stud.lab[i])
+
+    tstart = time.time()
+    try:
+        reportStage(stud.sid, 'extract')
+        if not extractLab(stud, i):
+            result['status'] = 'extract'
+        else:
+            reportStage(stud.sid, 'build')
+            runcmd = buildLab()
+            if not runcmd:
+                result['status'] = 'build'
+            else:
+                reportStage(stud.sid, 'test')
+                result['passed'] = autogradeLab(runcmd)
+                result['status'] = 'ok' if result['passed'] == result['total'] else 'fail'
+    except Exception as e:
+        print("*** Error: grading failed for " + stud.sid + ": " + str(e) + " ***\n")
+        result['status'] = 'error'
+    finally:
+        os.chdir(workdir)  # move back to working directory
+        result['elapsed'] = time.time() - tstart
+    return result
+
+
+def reportStage(sid='', stage=''):
+    '''
+    Report grading stage of a student to coordinator, if any
+    '''
+    if stagehook: stagehook(sid, stage)
+
+
+def workerId():
+    '''
+    Identifier of current grading process, 'host:pid'
+    '''
+    return socket.gethostname() + ':' + str(os.getpid())
+
+
+def parseAddress(addr=''):
+    '''
+    Convert 'host:port' into a socket address tuple,
+    any other string is used as a Unix socket path.
+    '''
+    host, sep, port = addr.rpartition(':')
+    if sep and port.isdigit(): return (host or 'localhost', int(port))
+    return os.path.abspath(addr)
+
+
+def isLocalAddress(addr=None):
+    '''
+    Check if socket address is only reachable from this host (Unix socket or loopback)
+    '''
+    if not isinstance(addr, tuple): return True
+    if addr[0] == 'localhost': return True
+    try: return ipaddress.ip_address(addr[0]).is_loopback
+    except ValueError: return False  # host name
+
+
+def formatAddress(addr=None):
+    '''
+    Convert a socket address into the string form accepted by parseAddress()
+    '''
+    if isinstance(addr, tuple): return addr[0] + ':' + str(addr[1])
+    return addr
+
+
+def getTaskQueue():
+    '''
+    Work queue served by coordinator
+    '''
+    return taskqueue
+
+
+def getResultQueue():
+    '''
+    Result queue served by coordinator
+    '''
+    return resultqueue
+
+
+def getBatchConfig():
+    '''
+    Build/grade options served by coordinator
+    '''
+    return batchconfig
+
+
+class GradeManager(BaseManager):
+    '''
+    Serves coordinator work/result queues over a TCP or Unix socket
+    '''
+    pass
+
+GradeManager.register('get_tasks', callable=getTaskQueue)
+GradeManager.register('get_results', callable=getResultQueue)
+GradeManager.register('get_config', callable=getBatchConfig)
+
+
+def gradeStudents(studlist=None):
+    '''
+    Grade students labs in batch mode, this process is the coordinator.
+    Students are put in a work queue served over a socket, worker processes
+    (local and/or remote) pull students, grade them and stream back results.
+    '''
+    os.chdir(workdir)  # move to working directory
+
+    # Watched labs are regraded when changed
+    global force
+    if watchtime: force = True
+
+    # Options workers need to build and grade like the coordinator
+    batchconfig.update({'compiler': compiler, 'cplusplus': cplusplus, 'python': python,
+                        'sourcext': sourcext, 'buildflags': buildflags, 'infiles': infiles,
+                        'outfiles': outfiles, 'force': force, 'runtimeout': runtimeout,
+                        'testjobs': testjobs, 'pywarm': pywarm, 'persist': bool(watchtime),
+                        'drivers': drivers, 'pchheaders': pchheaders})
+
+    # Key for workers, a random one unless given
+    global authkey
+    if not authkey:
+        authkey = secrets.token_hex(16)
+        if serveaddr: print("Worker key (--authkey or PGS_AUTHKEY): " + authkey)
+
+    # Serve queues from a background thread
+    address = parseAddress(serveaddr) if serveaddr else ('localhost', 0)
+    server = GradeManager(address=address, authkey=authkey.encode()).get_server()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    address = formatAddress(server.address)
+    print("Grading Program (batch mode), serving work at: " + address)
+
+    # Launch local workers, key is passed in environment (not visible in process list)
+    workers = []
+    workerenv = dict(os.environ, PGS_AUTHKEY=authkey)
+    for n in range(njobs):
+        # Worker messages would garble live status view
+        workers.append(subprocess.Popen([sys.executable, os.path.abspath(__file__),
+                                         '--worker', address, '-w', workdir],
+                                        env=workerenv,
+                                        stdout=subprocess.DEVNULL if liveStatus() else None))
+
+    try:
+        if watchtime: watchLabs(studlist, workers)
+        else:
+            results = dispatchStudents(studlist, workers)
+            printResults(list(results.values()))
+    except KeyboardInterrupt:
+        print("\n*** Batch grading interrupted ***\n")
+    finally:
+        subprockill(workers)
+
+
+def dispatchStudents(studlist=None, workers=[]):
+    '''
+    Shard students into work queue and collect results streamed back by workers.
+    Returns dictionary of results by student ID, in roster order.
+    '''
+    # Duplicate student IDs would be graded in the same directory, keep first
+    unique = {}
+    for stud in studlist:
+        if unique.setdefault(stud.sid, stud) is not stud:
+            print("*** Warning: duplicate student ID " + stud.sid + ", grading first entry ***")
+    studlist = list(unique.values())
+    monitor = BatchMonitor(len(studlist))
+
+    # Students without lab are not dispatched
+    results = {}
+    tasks = {}  # student ID --> task, of students not reported back yet
+    for stud in studlist:
+        if not stud.lab:
+            results[stud.sid] = gradeLab(stud)
+            monitor.finish(results[stud.sid])
+            continue
+        if len(stud.lab) > 1:
+            print("*** Warning: multiple labs for " + stud.sid + ", grading first one ***")
+        tasks[stud.sid] = (stud.sid, stud.fn, stud.lab, stud.pos)
+        taskqueue.put(tasks[stud.sid])
+
+    # Students being graded, student ID --> [worker, start time]
+    running = {}
+    lastseen = {}  # worker --> time of its last message
+    retried = set()
+    tidle = time.time()  # last time work was queued or running
+
+    # Student not reported back
+    def lost(sid):
+        running.pop(sid, None)
+        tasks.pop(sid)
+        results[sid] = {'sid': sid, 'name': unique[sid].fn, 'lab': '',
+                        'status': 'lost', 'passed': 0, 'total': len(infiles) or 1,
+                        'worker': '', 'elapsed': 0.0}
+        monitor.finish(results[sid])
+
+    # Worker gone, requeue its student once (it may be what crashes workers)
+    def retry(sid):
+        running.pop(sid, None)
+        if sid in retried: return lost(sid)
+        retried.add(sid)
+        monitor.requeue(sid)
+        taskqueue.put(tasks[sid])
+
+    # Deadline of a student after it started: build and sequential tests, with slack
+    jobtime = 120 + 2 * runtimeout * (len(infiles) or 1)
+
+    while tasks:
+        monitor.refresh()
+        try:
+            msg = resultqueue.get(timeout=1)
+        except queue.Empty:
+            # Without remote workers, stop if all local workers are gone
+            if not serveaddr and all(w.poll() is not None for w in workers): break
+            msg = ('',)
+        now = time.time()
+        if msg[0] == 'start':
+            lastseen[msg[2]] = now
+            running[msg[1]] = [msg[2], now]
+            monitor.start(msg[1], msg[2])
+        elif msg[0] == 'stage':
+            lastseen[msg[2]] = now
+            monitor.stage(msg[1], msg[3])
+        elif msg[0] == 'alive':
+            lastseen[msg[1]] = now
+        elif msg[0] == 'result':
+            lastseen[msg[1]['worker']] = now
+            if msg[1]['sid'] in tasks:
+                running.pop(msg[1]['sid'], None)
+                tasks.pop(msg[1]['sid'])
+                results[msg[1]['sid']] = msg[1]
+                monitor.finish(msg[1])
+
+        # Students of workers gone silent are retried, students past deadline are lost
+        for sid, (wid, tjob) in list(running.items()):
+            if now - lastseen[wid] > workertimeout: retry(sid)
+            elif now - tjob > jobtime: lost(sid)
+
+        # Students taken from queue by a worker gone before starting them
+        if running or not taskqueue.empty(): tidle = now
+        elif tasks and now - tidle > workertimeout:
+            for sid in list(tasks): retry(sid)
+            tidle = now
+    monitor.refresh(True)
+
+    # Students dispatched but never reported back
+    for sid in list(tasks): lost(sid)
+    return {stud.sid: results[stud.sid] for stud in studlist}
+
+
+def runWorker():
+    '''
+    Worker process, pull students from coordinator work queue,
+    grade them and stream back results.
+    '''
+    manager = GradeManager(address=parseAddress(workeraddr), authkey=authkey.encode())
+    manager.connect()
+    tasks = manager.get_tasks()
+    results = manager.get_results()
+
+    # Build/grade like the coordinator
+    globals().update(manager.get_config().copy())
+
+    os.chdir(workdir)  # move to working directory
+    wid = workerId()
+    global stagehook
+    stagehook = lambda sid, stage: results.put(('stage', sid, wid, stage))
+
+    # Heartbeat, coordinator retries students of silent workers
+    stopped = threading.Event()
+    def heartbeat():
+        try:
+            while not stopped.wait(workertimeout / 6): results.put(('alive', wid))
+        except (EOFError, OSError):
+            pass  # coordinator is gone
+    threading.Thread(target=heartbeat, daemon=True).start()
+    try:
+        while True:
+            # Watching coordinators keep sending work, wait for it
+            try:
+                if persist: sid, fn, lab, pos = tasks.get(timeout=1)
+                else: sid, fn, lab, pos = tasks.get_nowait()
+            except queue.Empty:
+                if persist: continue
+                break  # no more work
+            results.put(('start', sid, wid))
+            results.put(('result', gradeLab(Student(sid, fn, lab, pos))))
+    except (EOFError, ConnectionError):
+        pass  # coordinator is gone
+    finally:
+        stopped.set()
+
+
+def watchLabs(studlist=None, workers=[]):
+    '''
+    Poll labs directory and grade new/changed lab submissions of students
+    as they arrive. Labs and results are kept in 'pgs_watch.json' in the
+    working directory, so restarting does not regrade unchanged labs.
+    '''
+    statefile = os.path.join(workdir, "pgs_watch.json")
+    state = {'labs': {}, 'results': {}}
+    if os.path.exists(statefile):
+        with open(statefile, 'r') as fd: state = json.load(fd)
+
+    sidindex = {}
+    for stud in studlist: sidindex.setdefault(stud.sid, stud)
+    pending = {}  # signatures of labs seen changing in last poll
+    unmatched = set()  # labs not matching any student
+    print("Watching labs directory (every " + str(watchtime) + "s): " + labdir)
+    while True:
+        # Find new/changed labs, wait for labs still being written
+        candidates = {}  # lab --> (signature, student IDs)
+        changed = {}  # student ID --> (modification time, lab)
+        sigs = scanLabs()
+        ready = [name for name, sig in sigs.items()
+                 if state['labs'].get(name) != sig and name not in unmatched and
+                 (pending.get(name) == sig or time.time() - sig[0] / 1e9 >= watchtime)]
+
+        # Match labs to students as in interactive mode
+        if ready:
+            labindex = indexLabs(ready)
+            for sid, stud in sidindex.items():
+                for name in findLabs(sid, ready, labindex):
+                    sig = sigs[name]
+                    candidates.setdefault(name, (sig, []))[1].append(sid)
+                    if sid not in changed or changed[sid][0] < sig[0]:
+                        changed[sid] = (sig[0], name)
+        unmatched.update(name for name in ready if name not in candidates)
+        pending = sigs
+
+        # Grade most recent lab of each student
+        if changed:
+            updates = []
+            for sid, (mtime, name) in changed.items():
+                stud = sidindex[sid]
+                updates.append(Student(stud.sid, stud.fn, [os.path.join(labdir, name)], stud.pos))
+            results = dispatchStudents(updates, workers)
+            for stud in updates:
+                state['results'][stud.sid] = results[stud.sid]
+
+            # Older labs of a student are superseded, lost labs are retried
+            for name, (sig, sids) in candidates.items():
+                if all(results[sid]['status'] != 'lost' for sid in sids):
+                    state['labs'][name] = sig
+            saveState(statefile, state)
+            # Students without graded labs are listed as missing, as in batch mode
+            printResults([state['results'].get(stud.sid) or gradeLab(Student(stud.sid, stud.fn))
+                          for stud in sidindex.values()])
+
+        time.sleep(watchtime)
+
+
+def scanLabs():
+    '''
+    Signatures of labs in labs directory, [modification time, size] of files
+    and [latest modification time, total size, number of files] of directories
+    '''
+    sigs = {}
+    for entry in os.scandir(labdir):
+        if entry.name.startswith('.'): continue
+        try:
+            st = entry.stat()
+            if not entry.is_dir():
+                sigs[entry.name] = [st.st_mtime_ns, st.st_size]
+                continue
+            sig = [st.st_mtime_ns, 0, 0]
+            for root, dirs, files in os.walk(entry.path):
+                for afile in files:
+                    st = os.stat(os.path.join(root, afile))
+                    sig = [max(sig[0], st.st_mtime_ns), sig[1] + st.st_size, sig[2] + 1]
+            sigs[entry.name] = sig
+        except FileNotFoundError:
+            continue  # removed while scanning
+    return sigs
+
+
+def saveState(statefile='', state={}):
+    '''
+    Write JSON state file, replaced atomically
+    '''
+    with open(statefile + ".tmp", 'w') as fd: json.dump(state, fd)
+    os.replace(statefile + ".tmp", statefile)
+
+
+class BatchMonitor(object):
+    '''
+    Progress of a batch grading run: throughput, students per stage,
+    workers in flight, slowest current jobs and ETA. Shown as a live view
+    in the terminal and/or written as a metrics file (Prometheus text format).
+    '''
+    # Constructor
+    def __init__(self, total=0):
+        self.total = total
+        self.done = 0
+        self.failed = 0
+        self.started = 0
+        self.jobs = {}  # student ID --> [worker, stage, start time]
+        self.workers = set()
+        self.tstart = time.time()
+        self.tshown = 0.0  # last refresh time
+        self.nlines = 0  # lines of last live view
+
+    # Student grading started by a worker
+    def start(self, sid='', worker=''):
+        self.started = self.started + 1
+        self.workers.add(worker)
+        self.jobs[sid] = [worker, 'start', time.time()]
+
+    # Student put back in work queue
+    def requeue(self, sid=''):
+        self.jobs.pop(sid, None)
+
+    # Student moved to a grading stage
+    def stage(self, sid='', stage=''):
+        if sid in self.jobs: self.jobs[sid][1] = stage
+
+    # Student graded
+    def finish(self, result={}):
+        self.jobs.pop(result['sid'], None)
+        self.done = self.done + 1
+        if result['status'] != 'ok': self.failed = self.failed + 1
+
+    # Counters of progress
+    def counters(self):
+        elapsed = time.time() - self.tstart
+        rate = self.done / elapsed * 60 if elapsed > 0 else 0.0
+        stages = {stage: 0 for stage in ['extract', 'build', 'test']}
+        for worker, stage, tjob in self.jobs.values():
+            if stage in stages: stages[stage] = stages[stage] + 1
+        return {'total': self.total, 'done': self.done, 'failed': self.failed,
+                'queued': self.total - self.done - len(self.jobs) if self.total else 0,
+                'stages': stages, 'inflight': len(set(j[0] for j in self.jobs.values())),
+                'workers': len(self.workers), 'rate': rate,
+                'eta': (self.total - self.done) / rate * 60 if rate > 0 else -1,
+                'slowest': sorted([(time.time() - j[2], sid, j[1], j[0]) for sid, j in self.jobs.items()],
+                                  reverse=True)[:3]}
+
+    # Show live view and rewrite metrics file, at most once a second
+    def refresh(self, final=False):
+        if not final and time.time() - self.tshown < 1: return
+        self.tshown = time.time()
+        c = self.counters()
+        if metricsfile: writeMetrics(c)
+        if not liveStatus(): return
+
+        eta = "--" if c['eta'] < 0 else "{:d}m{:02d}s".format(int(c['eta']) // 60, int(c['eta']) % 60)
+        lines = ["PGS batch: {}/{} done ({} failed) | {:.1f} students/min | ETA {}".format(
+                     c['done'], c['total'], c['failed'], c['rate'], eta),
+                 "queued {} | ".format(c['queued']) +
+                 " | ".join([stage + ' ' + str(n) for stage, n in c['stages'].items()]) +
+                 " | workers {} busy / {} seen".format(c['inflight'], c['workers']),
+                 "slowest: " + (", ".join(["{} {} {:.1f}s ({})".format(sid, stage, t, w)
+                                           for t, sid, stage, w in c['slowest']]) or "--")]
+        if self.nlines: sys.stdout.write("\033[" + str(self.nlines) + "F\033[J")  # redraw in place
+        sys.stdout.write('\n'.join(lines) + '\n')
+        sys.stdout.flush()
+        self.nlines = 0 if final else len(lines)
+
+
+def liveStatus():
+    '''
+    Check if live status view of batch grading is shown
+    '''
+    return showstatus and sys.stdout.isatty()
+
+
+def writeMetrics(c={}):
+    '''
+    Rewrite metrics file (Prometheus text format) with batch progress counters
+    '''
+    slowest = c['slowest'][0][0] if c['slowest'] else 0.0
+    metrics = [('pgs_students', 'gauge', 'Students in batch', [('', c['total'])]),
+               ('pgs_students_done_total', 'counter', 'Students graded', [('', c['done'])]),
+               ('pgs_students_failed_total', 'counter', 'Students graded without passing',
+                [('', c['failed'])]),
+               ('pgs_students_queued', 'gauge', 'Students waiting for a worker', [('', c['queued'])]),
+               ('pgs_students_inflight', 'gauge', 'Students being graded by stage',
+                [('{stage="' + stage + '"}', n) for stage, n in c['stages'].items()]),
+               ('pgs_workers_inflight', 'gauge', 'Workers grading a student', [('', c['inflight'])]),
+               ('pgs_workers_seen', 'gauge', 'Workers that started a student', [('', c['workers'])]),
+               ('pgs_students_per_minute', 'gauge', 'Grading throughput',
+                [('', "{:.3f}".format(c['rate']))]),
+               ('pgs_eta_seconds', 'gauge', 'Estimated time to finish, -1 if unknown',
+                [('', "{:.1f}".format(c['eta']))]),
+               ('pgs_slowest_job_seconds', 'gauge', 'Run time of slowest current student',
+                [('', "{:.1f}".format(slowest))]),
+               ('pgs_metrics_timestamp_seconds', 'gauge', 'Time metrics were written',
+                [('', "{:.0f}".format(time.time()))])]
+    lines = []
+    for name, mtype, mhelp, samples in metrics:
+        lines = lines + ["# HELP " + name + " " + mhelp, "# TYPE " + name + " " + mtype]
+        lines = lines + [name + labels + " " + str(value) for labels, value in samples]
+    with open(metricsfile + ".tmp", 'w') as fd: fd.write('\n'.join(lines) + '\n')
+    os.replace(metricsfile + ".tmp", metricsfile)
+
+
+def printResults(results=[]):
+    '''
+    Print table of batch grading results and save it as 'pgs_results.tsv'
+    in the working directory.
+    '''
+    print("\n\n*** Grading results ***\n")
+    fields = ['sid', 'name', 'lab', 'status', 'passed', 'total', 'worker', 'elapsed']
+    with open(os.path.join(workdir, "pgs_results.tsv"), 'w') as fd:
+        fd.write('\t'.join(fields) + '\n')
+        for res in results:
+            fd.write('\t'.join([str(res[f]) for f in fields]) + '\n')
+            print("{:<12} {:<24} {:<8} {:>3}/{:<3} {:>7.2f}s  {}".format(
+                  res['sid'], res['name'][:24], res['status'], res['passed'],
+                  res['total'], res['elapsed'], res['lab']))
+    print()
 
 
 '''
@@ -677,5 +2196,9 @@ Main entry point
 '''
 if __name__ == "__main__":
     if parseArgs():
-        processStudents(loadStudents())
+        if workeraddr: runWorker()
+        elif batch:
+            studlist = loadStudents()
+            if studlist: gradeStudents(studlist)
+        else: processStudents(loadStudents())
 
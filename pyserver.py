@@ -0,0 +1,198 @@
+'''
+Pre-warmed Python interpreter server
+
+Keeps an interpreter with common modules already imported and runs Python
+programs on request, each in a forked child with a clean '__main__',
+stdin/stdout/stderr redirected to file descriptors sent with the request,
+and its own working directory and arguments. Only uses standard library,
+so it runs under the same interpreter as the programs being graded.
+
+Requests are served over a Unix socket, one request per connection:
+    client --> {"script": path, "args": [...], "cwd": path} + fds (stdin, stdout, stderr)
+    server --> {"pid": program process ID}
+    client --> kill (optional, e.g., time limit exceeded; also if client disconnects)
+    server --> {"status": wait status, "utime": seconds, "stime": seconds}
+
+Example:
+python3 pyserver.py /tmp/pgs/py.sock math collections itertools
+'''
+
+import sys
+import os  # other modules are imported by serve(), after the warm modules
+
+
+def serve(sockpath='', modules=[]):
+    '''
+    Pre-import modules and serve requests until parent process exits
+    '''
+    for m in modules:
+        try: __import__(m)
+        except ImportError: pass
+
+    # Server modules are imported after the warm ones, so only modules the warm
+    # ones did not load are removed before running a program (programs must share
+    # the same module objects as the warm modules, e.g., for isinstance() checks)
+    warm = set(sys.modules)
+    global json, socket, signal, select, types, atexit
+    import json
+    import socket
+    import signal
+    import select
+    import types
+    import atexit
+    extra = set(sys.modules) - warm
+    basepath = sys.path[1:]  # drop directory of this script
+
+    # Supervisor processes are reaped automatically
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+
+    ppid = os.getppid()
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(sockpath)
+    sock.listen(64)
+    sock.settimeout(1)
+    while os.getppid() == ppid:
+        try:
+            conn, addr = sock.accept()
+        except socket.timeout:
+            continue
+        conn.settimeout(None)
+        if os.fork() == 0:
+            sock.close()
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            supervise(conn, extra, basepath)
+        conn.close()
+    sock.close()
+    os.remove(sockpath)
+
+
+def supervise(conn=None, extra=set(), basepath=[]):
+    '''
+    Supervisor process of a request, fork program process,
+    report its process ID and then its exit status. Never returns.
+    '''
+    try:
+        # Read request line, file descriptors arrive with first chunk
+        msg, fds, flags, addr = socket.recv_fds(conn, 65536, 3)
+        while not msg.endswith(b'\n'):
+            chunk = conn.recv(65536)
+            if not chunk: os._exit(1)
+            msg = msg + chunk
+        req = json.loads(msg)
+
+        pid = os.fork()
+        if pid == 0:
+            conn.close()
+            runScript(req, fds, extra, basepath)
+        for fd in fds: os.close(fd)
+        conn.sendall(json.dumps({'pid': pid}).encode() + b'\n')
+
+        status, rusage = waitProgram(conn, pid)
+        conn.sendall(json.dumps({'status': status, 'utime': rusage.ru_utime,
+                                 'stime': rusage.ru_stime}).encode() + b'\n')
+    finally:
+        os._exit(0)
+
+
+def waitProgram(conn=None, pid=0):
+    '''
+    Wait for program to exit, killing it if client asks to or disconnects.
+    Only the supervisor (its parent) kills it, so the process ID cannot be reused meanwhile.
+    Returns wait status and resource usage.
+    '''
+    try: pidfd = os.pidfd_open(pid)
+    except (AttributeError, OSError): pidfd = None  # poll instead
+    watched = [conn] + ([pidfd] if pidfd is not None else [])
+    while True:
+        wpid, status, rusage = os.wait4(pid, os.WNOHANG)
+        if wpid: return status, rusage
+        ready = select.select(watched, [], [], None if pidfd is not None else 0.05)[0]
+        if conn in ready:
+            conn.recv(64)  # kill request, or empty if client disconnected
+            os.kill(pid, signal.SIGKILL)
+            watched.remove(conn)
+
+
+def runScript(req={}, fds=[], extra=set(), basepath=[]):
+    '''
+    Run requested script as '__main__' in current (forked) process. Never returns.
+    '''
+    code = 1
+    try:
+        # Redirect standard streams
+        for i, fd in enumerate(fds): os.dup2(fd, i)
+        for fd in set(fds): os.close(fd)
+
+        # Same view of the interpreter as a fresh 'python3 script args'
+        os.chdir(req['cwd'])
+        for name in extra: sys.modules.pop(name, None)
+        atexit._clear()  # handlers registered by warm modules
+        script = os.path.abspath(req['script'])
+        sys.argv = [req['script']] + req['args']
+        sys.path[:] = [os.path.dirname(script)] + basepath
+        sys.stdin = sys.__stdin__ = open(0, 'r', closefd=False)
+        sys.stdout = sys.__stdout__ = open(1, 'w', closefd=False)
+        sys.stderr = sys.__stderr__ = open(2, 'w', buffering=1, errors='backslashreplace',
+                                           closefd=False)
+
+        # Missing script, same message and exit code as interpreter
+        try:
+            with open(script, 'rb') as fd: source = fd.read()
+        except OSError as e:
+            interp = (getattr(sys, 'orig_argv', None) or [sys.executable])[0]
+            print(interp + ": can't open file " + repr(script) + ": [Errno " + str(e.errno) +
+                  "] " + e.strerror, file=sys.stderr)
+            code = 2
+            return
+
+        code = runMain(script, source)
+
+        # Interpreter shutdown: join threads, run exit handlers, flush streams
+        if 'threading' in sys.modules: sys.modules['threading']._shutdown()
+        atexit._run_exitfuncs()
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        except BaseException: pass
+        os._exit(code)
+
+
+def runMain(script='', source=b''):
+    '''
+    Execute script source in a new '__main__' module, returns exit code
+    '''
+    main = types.ModuleType('__main__')
+    main.__file__ = script
+    main.__cached__ = None
+    main.__builtins__ = __builtins__
+    sys.modules['__main__'] = main
+    try:
+        exec(compile(source, script, 'exec'), main.__dict__)
+    except SystemExit as e:
+        return exitCode(e)
+    except SyntaxError as e:
+        sys.excepthook(type(e), e.with_traceback(None), None)  # no traceback, as interpreter
+        return 1
+    except BaseException as e:
+        tb = e.__traceback__.tb_next  # skip this frame
+        sys.excepthook(type(e), e.with_traceback(tb), tb)
+        return 1
+    return 0
+
+
+def exitCode(e=None):
+    '''
+    Exit code of a SystemExit, non-integer codes are printed
+    '''
+    if e.code is None: return 0
+    if isinstance(e.code, int): return e.code
+    print(e.code, file=sys.stderr)
+    return 1
+
+
+'''
+Main entry point
+'''
+if __name__ == "__main__":
+    serve(sys.argv[1], sys.argv[2:])
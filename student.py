@@ -2,11 +2,13 @@
 Student object
 '''
 class Student(object):
+    __slots__ = ('sid', 'fn', 'lab', 'pos')
+
     # Constructor
-    def __init__(self, sid='', fn='', labfile=[], pos=-1):
+    def __init__(self, sid='', fn='', labfile=None, pos=-1):
         self.sid = sid
         self.fn = fn
-        self.lab = labfile
+        self.lab = labfile if labfile is not None else []
         self.pos = pos
 
     # Print student info